@@ -421,8 +421,9 @@ Output:
         email = self.nonreg_user_map[name]
         return get_user_by_delivery_email(email, get_realm("zulip"))
 
-    def example_user(self, name: str) -> UserProfile:
-        email = self.example_user_map[name]
+    @classmethod
+    def example_user(cls, name: str) -> UserProfile:
+        email = cls.example_user_map[name]
         return get_user_by_delivery_email(email, get_realm("zulip"))
 
     def mit_user(self, name: str) -> UserProfile:
@@ -1,4 +1,6 @@
-from typing import Any, Dict
+import contextlib
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, cast
 from unittest import mock
 
 import orjson
@@ -15,6 +17,7 @@ from zerver.lib.test_classes import ZulipTestCase
 from zerver.lib.topic import TOPIC_NAME
 from zerver.lib.url_encoding import near_message_url
 from zerver.lib.users import add_service
+from zerver.lib.utils import generate_api_key
 from zerver.models import Recipient, Service, UserProfile, get_display_recipient, get_realm
 
 
@@ -25,6 +28,42 @@ class ResponseMock:
         self.text = content.decode()
 
 
+# ResponseMock objects are never mutated by the code under test, so we
+# share these between tests rather than building them over and over.
+_RESP_200_EMPTY = ResponseMock(200)
+_RESP_200_CONTENT = ResponseMock(200, orjson.dumps({"content": "whatever"}))
+_RESP_400 = ResponseMock(400)
+_RESP_407 = ResponseMock(407)
+_RESP_500 = ResponseMock(500)
+_RESP_STRING_BYTES = orjson.dumps({"response_string": "Hidley ho, I'm a webhook responding!"})
+_RESP_HIDLEY = ResponseMock(200, _RESP_STRING_BYTES)
+
+# Expected notifications to the bot owner for the mock event used in DoRestCallTests.
+_NEAR_URL = "http://zulip.testserver/#narrow/stream/999-Verona/topic/Foo/near/"
+_NOTIFICATION_PREFIX = (
+    f"[A message]({_NEAR_URL}) to your bot @_**Outgoing Webhook** triggered an outgoing webhook."
+)
+_RETRY_NOTIFICATION = f"{_NOTIFICATION_PREFIX}\nThe webhook got a response with status code *500*."
+_FAIL_NOTIFICATION = f"{_NOTIFICATION_PREFIX}\nThe webhook got a response with status code *400*."
+_EXCEPTION_NOTIFICATION = f"""{_NOTIFICATION_PREFIX}
+When trying to send a request to the webhook service, an exception of type RequestException occurred:
+```
+I'm a generic exception :(
+```"""
+
+
+class _FakeSession:
+    """A minimal stand-in for requests.Session; cheaper to build than
+    mock.Mock(spec=requests.Session)."""
+
+    __slots__ = ("headers", "post", "send")
+
+    def __init__(self, response: ResponseMock) -> None:
+        self.headers: Dict[str, str] = {}
+        self.post = mock.Mock(return_value=response)
+        self.send = mock.Mock(return_value=response)
+
+
 def request_exception_error(final_url: Any, **request_kwargs: Any) -> Any:
     raise requests.exceptions.RequestException("I'm a generic exception :(")
 
@@ -38,7 +77,29 @@ def connection_error(final_url: Any, **request_kwargs: Any) -> Any:
 
 
 class DoRestCallTests(ZulipTestCase):
-    def mock_event(self, bot_user: UserProfile) -> Dict[str, Any]:
+    bot_user: UserProfile
+    service_handler: GenericOutgoingWebhookService
+    _mock_event_template: Mapping[str, Any]
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.bot_user = cls.example_user("outgoing_webhook_bot")
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        # These aren't database fixtures, so they're built here rather
+        # than in setUpTestData.  Reuse a single service handler (and
+        # thus a single requests.Session) across all of the tests in
+        # this class.
+        cls.service_handler = GenericOutgoingWebhookService("token", cls.bot_user, "service")
+        # The template is shared by every test, so make it read-only to
+        # catch accidental mutation.  do_rest_call is typed to take a
+        # Dict, so tests that only read the event cast it at the call.
+        cls._mock_event_template = MappingProxyType(cls._build_mock_event(cls.bot_user))
+
+    @staticmethod
+    def _build_mock_event(bot_user: UserProfile) -> Dict[str, Any]:
         return {
             # In the tests there is no active queue processor, so retries don't get processed.
             # Therefore, we need to emulate `retry_event` in the last stage when the maximum
@@ -70,71 +131,77 @@ class DoRestCallTests(ZulipTestCase):
         }
 
     def test_successful_request(self) -> None:
-        bot_user = self.example_user("outgoing_webhook_bot")
-        mock_event = self.mock_event(bot_user)
-        service_handler = GenericOutgoingWebhookService("token", bot_user, "service")
+        bot_user = self.bot_user
+        mock_event = self._mock_event_template
+        service_handler = self.service_handler
 
         expect_send_response = mock.patch("zerver.lib.outgoing_webhook.send_response_message")
         with mock.patch.object(
             service_handler, "session"
         ) as session, expect_send_response as mock_send:
-            session.post.return_value = ResponseMock(200, orjson.dumps(dict(content="whatever")))
-            do_rest_call("", mock_event, service_handler)
+            session.post.return_value = _RESP_200_CONTENT
+            do_rest_call("", cast(Dict[str, Any], mock_event), service_handler)
         self.assertTrue(mock_send.called)
 
-        for service_class in [GenericOutgoingWebhookService, SlackOutgoingWebhookService]:
-            handler = service_class("token", bot_user, "service")
-            with mock.patch.object(handler, "session") as session:
-                session.post.return_value = ResponseMock(200)
-                do_rest_call("", mock_event, handler)
+        handlers = [
+            service_handler,
+            SlackOutgoingWebhookService("token", bot_user, "service"),
+        ]
+        with contextlib.ExitStack() as stack:
+            sessions = [
+                stack.enter_context(mock.patch.object(handler, "session")) for handler in handlers
+            ]
+            for session in sessions:
+                session.post.return_value = _RESP_200_EMPTY
+            for handler in handlers:
+                do_rest_call("", cast(Dict[str, Any], mock_event), handler)
+            for session in sessions:
                 session.post.assert_called_once()
 
     def test_retry_request(self) -> None:
-        bot_user = self.example_user("outgoing_webhook_bot")
-        mock_event = self.mock_event(bot_user)
-        service_handler = GenericOutgoingWebhookService("token", bot_user, "service")
+        bot_user = self.bot_user
+        mock_event = self._mock_event_template
+        service_handler = self.service_handler
 
         with mock.patch.object(service_handler, "session") as session, self.assertLogs(
             level="WARNING"
         ) as m:
-            session.post.return_value = ResponseMock(500)
-            final_response = do_rest_call("", mock_event, service_handler)
+            session.post.return_value = _RESP_500
+            final_response = do_rest_call("", cast(Dict[str, Any], mock_event), service_handler)
             assert final_response is not None
 
             self.assertEqual(
                 m.output,
                 [
-                    f'WARNING:root:Message http://zulip.testserver/#narrow/stream/999-Verona/topic/Foo/near/ triggered an outgoing webhook, returning status code 500.\n Content of response (in quotes): "{final_response.text}"'
+                    f'WARNING:root:Message {_NEAR_URL} triggered an outgoing webhook, returning status code 500.\n Content of response (in quotes): "{final_response.text}"'
                 ],
             )
         bot_owner_notification = self.get_last_message()
         self.assertEqual(
             bot_owner_notification.content,
-            """[A message](http://zulip.testserver/#narrow/stream/999-Verona/topic/Foo/near/) to your bot @_**Outgoing Webhook** triggered an outgoing webhook.
-The webhook got a response with status code *500*.""",
+            _RETRY_NOTIFICATION,
         )
 
         assert bot_user.bot_owner is not None
         self.assertEqual(bot_owner_notification.recipient_id, bot_user.bot_owner.recipient_id)
 
-    def test_fail_request(self) -> None:
-        bot_user = self.example_user("outgoing_webhook_bot")
-        mock_event = self.mock_event(bot_user)
-        service_handler = GenericOutgoingWebhookService("token", bot_user, "service")
-
-        expect_fail = mock.patch("zerver.lib.outgoing_webhook.fail_with_message")
+    @mock.patch("zerver.lib.outgoing_webhook.fail_with_message")
+    def test_fail_request(self, mock_fail: mock.Mock) -> None:
+        bot_user = self.bot_user
+        mock_event = self._mock_event_template
+        service_handler = self.service_handler
 
-        with mock.patch.object(
-            service_handler, "session"
-        ) as session, expect_fail as mock_fail, self.assertLogs(level="WARNING") as m:
-            session.post.return_value = ResponseMock(400)
-            final_response = do_rest_call("", mock_event, service_handler)
+        with mock.patch.object(service_handler, "session") as session, self.assertLogs(
+            level="WARNING"
+        ) as m:
+            session.post.return_value = _RESP_400
+            final_response = do_rest_call("", cast(Dict[str, Any], mock_event), service_handler)
             assert final_response is not None
 
             self.assertEqual(
                 m.output,
                 [
-                    f'WARNING:root:Message http://zulip.testserver/#narrow/stream/999-Verona/topic/Foo/near/ triggered an outgoing webhook, returning status code 400.\n Content of response (in quotes): "{final_response.text}"'
+                    f'WARNING:root:Message {_NEAR_URL} triggered an outgoing webhook, returning status code 400.\n Content of response (in quotes): "{final_response.text}"'
                 ],
             )
 
@@ -143,22 +210,22 @@ The webhook got a response with status code *500*.""",
         bot_owner_notification = self.get_last_message()
         self.assertEqual(
             bot_owner_notification.content,
-            """[A message](http://zulip.testserver/#narrow/stream/999-Verona/topic/Foo/near/) to your bot @_**Outgoing Webhook** triggered an outgoing webhook.
-The webhook got a response with status code *400*.""",
+            _FAIL_NOTIFICATION,
         )
 
         assert bot_user.bot_owner is not None
         self.assertEqual(bot_owner_notification.recipient_id, bot_user.bot_owner.recipient_id)
 
     def test_headers(self) -> None:
-        bot_user = self.example_user("outgoing_webhook_bot")
-        mock_event = self.mock_event(bot_user)
-        service_handler = GenericOutgoingWebhookService("token", bot_user, "service")
+        mock_event = self._mock_event_template
+        service_handler = self.service_handler
 
         session = service_handler.session
         with mock.patch.object(session, "send") as mock_send:
-            mock_send.return_value = ResponseMock(200)
-            final_response = do_rest_call("https://example.com/", mock_event, service_handler)
+            mock_send.return_value = _RESP_200_EMPTY
+            final_response = do_rest_call(
+                "https://example.com/", cast(Dict[str, Any], mock_event), service_handler
+            )
             assert final_response is not None
 
             mock_send.assert_called_once()
@@ -169,18 +236,19 @@ The webhook got a response with status code *400*.""",
                 "User-Agent": user_agent,
                 "X-Smokescreen-Role": "webhook",
             }
-            self.assertLessEqual(headers.items(), prepared_request.headers.items())
+            for key, value in headers.items():
+                self.assertEqual(prepared_request.headers.get(key), value)
 
     def test_error_handling(self) -> None:
-        bot_user = self.example_user("outgoing_webhook_bot")
-        mock_event = self.mock_event(bot_user)
-        service_handler = GenericOutgoingWebhookService("token", bot_user, "service")
+        bot_user = self.bot_user
+        # do_rest_call bumps "failed_tries" on retries, so work on a copy.
+        mock_event = dict(self._mock_event_template)
+        service_handler = self.service_handler
         bot_user_email = self.example_user_map["outgoing_webhook_bot"]
 
-        def helper(side_effect: Any, error_text: str) -> None:
-            with mock.patch.object(service_handler, "session") as session:
-                session.post.side_effect = side_effect
-                do_rest_call("", mock_event, service_handler)
+        def helper(session: mock.MagicMock, side_effect: Any, error_text: str) -> None:
+            session.post.side_effect = side_effect
+            do_rest_call("", mock_event, service_handler)
 
             bot_owner_notification = self.get_last_message()
             self.assertIn(error_text, bot_owner_notification.content)
@@ -188,9 +256,13 @@ The webhook got a response with status code *400*.""",
             assert bot_user.bot_owner is not None
             self.assertEqual(bot_owner_notification.recipient_id, bot_user.bot_owner.recipient_id)
 
-        with self.assertLogs(level="INFO") as i:
-            helper(side_effect=timeout_error, error_text="A timeout occurred.")
-            helper(side_effect=connection_error, error_text="A connection error occurred.")
+        with self.assertLogs(level="INFO") as i, mock.patch.object(
+            service_handler, "session"
+        ) as session:
+            helper(session, side_effect=timeout_error, error_text="A timeout occurred.")
+            helper(
+                session, side_effect=connection_error, error_text="A connection error occurred."
+            )
 
             log_output = [
                 f"INFO:root:Trigger event {mock_event['command']} on {mock_event['service_name']} timed out. Retrying",
@@ -201,49 +273,66 @@ The webhook got a response with status code *400*.""",
 
             self.assertEqual(i.output, log_output)
 
-    def test_request_exception(self) -> None:
-        bot_user = self.example_user("outgoing_webhook_bot")
-        mock_event = self.mock_event(bot_user)
-        service_handler = GenericOutgoingWebhookService("token", bot_user, "service")
+    @mock.patch("zerver.lib.outgoing_webhook.fail_with_message")
+    def test_request_exception(self, mock_fail: mock.Mock) -> None:
+        bot_user = self.bot_user
+        mock_event = self._mock_event_template
+        service_handler = self.service_handler
 
         expect_logging_exception = self.assertLogs(level="ERROR")
-        expect_fail = mock.patch("zerver.lib.outgoing_webhook.fail_with_message")
 
         # Don't think that we should catch and assert whole log output(which is actually a very big error traceback).
         # We are already asserting bot_owner_notification.content which verifies exception did occur.
-        with mock.patch.object(
-            service_handler, "session"
-        ) as session, expect_logging_exception, expect_fail as mock_fail:
+        with mock.patch.object(service_handler, "session") as session, expect_logging_exception:
             session.post.side_effect = request_exception_error
-            do_rest_call("", mock_event, service_handler)
+            do_rest_call("", cast(Dict[str, Any], mock_event), service_handler)
 
         self.assertTrue(mock_fail.called)
 
         bot_owner_notification = self.get_last_message()
         self.assertEqual(
             bot_owner_notification.content,
-            """[A message](http://zulip.testserver/#narrow/stream/999-Verona/topic/Foo/near/) to your bot @_**Outgoing Webhook** triggered an outgoing webhook.
-When trying to send a request to the webhook service, an exception of type RequestException occurred:
-```
-I'm a generic exception :(
-```""",
+            _EXCEPTION_NOTIFICATION,
         )
         assert bot_user.bot_owner is not None
         self.assertEqual(bot_owner_notification.recipient_id, bot_user.bot_owner.recipient_id)
 
 
 class TestOutgoingWebhookMessaging(ZulipTestCase):
-    def create_outgoing_bot(self, bot_owner: UserProfile) -> UserProfile:
-        return self.create_test_bot(
-            "outgoing-webhook",
-            bot_owner,
+    bot_owner: UserProfile
+    sender: UserProfile
+    bot: UserProfile
+
+    @classmethod
+    def setUpTestData(cls) -> None:
+        cls.bot_owner = cls.example_user("othello")
+        cls.sender = cls.example_user("hamlet")
+        cls.bot = cls.create_outgoing_bot(cls.bot_owner)
+
+    @classmethod
+    def create_outgoing_bot(cls, bot_owner: UserProfile) -> UserProfile:
+        # This mirrors what create_test_bot does through the API, but
+        # doesn't need a test client, so it can run in setUpTestData.
+        bot = do_create_user(
+            email=f"outgoing-webhook-bot@{bot_owner.realm.get_bot_domain()}",
+            password=None,
+            realm=bot_owner.realm,
             full_name="Outgoing Webhook bot",
             bot_type=UserProfile.OUTGOING_WEBHOOK_BOT,
-            service_name="foo-service",
+            bot_owner=bot_owner,
+            acting_user=bot_owner,
+        )
+        add_service(
+            name="foo-service",
+            user_profile=bot,
+            base_url="",
+            interface=Service.GENERIC,
+            token=generate_api_key(),
         )
+        return bot
 
     def test_multiple_services(self) -> None:
-        bot_owner = self.example_user("othello")
+        bot_owner = self.bot_owner
 
         bot = do_create_user(
             bot_owner=bot_owner,
@@ -271,11 +360,9 @@ class TestOutgoingWebhookMessaging(ZulipTestCase):
             token="qotd_token",
         )
 
-        sender = self.example_user("hamlet")
+        sender = self.sender
 
-        session = mock.Mock(spec=requests.Session)
-        session.headers = {}
-        session.post.return_value = ResponseMock(200)
+        session = _FakeSession(_RESP_200_EMPTY)
         with mock.patch("zerver.lib.outgoing_webhook.Session") as sessionmaker:
             sessionmaker.return_value = session
             self.send_personal_message(
@@ -306,15 +393,10 @@ class TestOutgoingWebhookMessaging(ZulipTestCase):
         )
 
     def test_pm_to_outgoing_webhook_bot(self) -> None:
-        bot_owner = self.example_user("othello")
-        bot = self.create_outgoing_bot(bot_owner)
-        sender = self.example_user("hamlet")
-
-        session = mock.Mock(spec=requests.Session)
-        session.headers = {}
-        session.post.return_value = ResponseMock(
-            200, orjson.dumps({"response_string": "Hidley ho, I'm a webhook responding!"})
-        )
+        bot = self.bot
+        sender = self.sender
+
+        session = _FakeSession(_RESP_HIDLEY)
         with mock.patch("zerver.lib.outgoing_webhook.Session") as sessionmaker:
             sessionmaker.return_value = session
             self.send_personal_message(sender, bot, content="foo")
@@ -331,14 +413,12 @@ class TestOutgoingWebhookMessaging(ZulipTestCase):
         )
 
     def test_pm_to_outgoing_webhook_bot_for_407_error_code(self) -> None:
-        bot_owner = self.example_user("othello")
-        bot = self.create_outgoing_bot(bot_owner)
-        sender = self.example_user("hamlet")
+        bot_owner = self.bot_owner
+        bot = self.bot
+        sender = self.sender
         realm = get_realm("zulip")
 
-        session = mock.Mock(spec=requests.Session)
-        session.headers = {}
-        session.post.return_value = ResponseMock(407)
+        session = _FakeSession(_RESP_407)
         expect_fail = mock.patch("zerver.lib.outgoing_webhook.fail_with_message")
 
         with mock.patch(
@@ -375,14 +455,10 @@ class TestOutgoingWebhookMessaging(ZulipTestCase):
             self.assertTrue(mock_fail.called)
 
     def test_stream_message_to_outgoing_webhook_bot(self) -> None:
-        bot_owner = self.example_user("othello")
-        bot = self.create_outgoing_bot(bot_owner)
+        bot_owner = self.bot_owner
+        bot = self.bot
 
-        session = mock.Mock(spec=requests.Session)
-        session.headers = {}
-        session.post.return_value = ResponseMock(
-            200, orjson.dumps({"response_string": "Hidley ho, I'm a webhook responding!"})
-        )
+        session = _FakeSession(_RESP_HIDLEY)
         with mock.patch("zerver.lib.outgoing_webhook.Session") as sessionmaker:
             sessionmaker.return_value = session
             self.send_stream_message(